@@ -0,0 +1,259 @@
+import base64
+import collections
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+
+from pyVmomi import vim
+from pyVmomi import SoapStubAdapter
+
+
+class CassetteError(Exception):
+    pass
+
+
+class Cassette(object):
+    """Records vCenter SOAP exchanges and ESXi SSH commands to a compact file and serves them back without network access
+    SOAP traffic is captured at the HTTP connection of the pyVmomi stub, so everything built on top of it
+    (property access, tasks, property collector) replays unchanged. SSH is captured per command with stdout/stderr.
+    Replayed responses are matched on the request (SOAP body or host + command) in recorded order.
+    Args:
+        path:           gzip'd JSON cassette file
+        mode:           'record' or 'replay'
+        latency_scale:  replay only; None serves responses immediately, 1.0 replays recorded latencies, 0.5 halves them
+
+    Example:
+        As Reference
+                tape = cassette.Cassette('/tmp/audit.cassette', mode='record')
+                y = vmware.VMWare(vc_userid = 'myVMwareAdminId', vc_passwd = 'myVMwareAdminpassword', vc_fqdn ='myVsphereFQDN', esxi_user='myEsxiAdminId', esxi_password='myEsxiAdminpass', cassette=tape)
+                    records every call, written on exit or with tape.save()
+                tape = cassette.Cassette('/tmp/audit.cassette', mode='replay', latency_scale=1.0)
+                    same calls served from the file with their original timing
+    """
+
+    def __init__(self, path, mode='replay', latency_scale=None):
+        if mode not in ('record', 'replay'):
+            raise CassetteError("Unknown cassette mode '{}', use 'record' or 'replay'".format(mode))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.interactions = []
+        self.queues = {}
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, 'rb') as fd:
+                data = json.loads(fd.read().decode('utf-8'))
+        except IOError as ex:
+            raise CassetteError("Unable to read cassette {}: {}".format(self.path, ex))
+        self.meta = data['meta']
+        self.interactions = data['interactions']
+        for interaction in self.interactions:
+            self.queues.setdefault(interaction['key'], collections.deque()).append(interaction)
+        print "INFO: Loaded {} interactions from cassette {}".format(len(self.interactions), self.path)
+
+    def save(self):
+        if self.mode != 'record':
+            return
+        with self.lock:
+            data = {'meta': self.meta, 'interactions': self.interactions}
+            with gzip.open(self.path, 'wb') as fd:
+                fd.write(json.dumps(data).encode('utf-8'))
+        print "INFO: Saved {} interactions to cassette {}".format(len(self.interactions), self.path)
+
+    def _key(self, kind, *parts):
+        digest = hashlib.sha1()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = part.encode('utf-8')
+            digest.update(part)
+        return "{}:{}".format(kind, digest.hexdigest())
+
+    def _record(self, key, elapsed, **fields):
+        fields['key'] = key
+        fields['elapsed'] = elapsed
+        with self.lock:
+            self.interactions.append(fields)
+
+    def _replay(self, key, description):
+        with self.lock:
+            queue = self.queues.get(key)
+            if not queue:
+                raise CassetteError("No recorded interaction left for {}".format(description))
+            interaction = queue.popleft()
+        if self.latency_scale:
+            time.sleep(interaction['elapsed'] * self.latency_scale)
+        return interaction
+
+    # vCenter (SOAP)
+
+    def attach(self, service_instance):
+        """
+        Starts recording on a connected service instance
+        """
+        stub = service_instance._stub
+        self.meta['version'] = stub.version
+        stub.scheme = self._connection_factory(stub.scheme)
+        # GetConnection prefers pooled connections over the scheme; drop the ones opened during login
+        stub.DropConnections()
+
+    def get_service_instance(self, host):
+        """
+        Builds a service instance served entirely from the cassette
+        """
+        stub = SoapStubAdapter(host=host, version=self.meta['version'])
+        stub.scheme = self._connection_factory(None)
+        return vim.ServiceInstance('ServiceInstance', stub)
+
+    def _connection_factory(self, scheme):
+        def factory(host, **kwargs):
+            if self.mode == 'record':
+                return _RecordingHTTPConnection(self, scheme(host, **kwargs))
+            return _ReplayHTTPConnection(self)
+        return factory
+
+    def record_soap(self, body, status, reason, headers, response_body, elapsed):
+        self._record(self._key('soap', body), elapsed,
+                     status=status,
+                     reason=reason,
+                     headers=headers,
+                     body=base64.b64encode(response_body).decode('ascii'))
+
+    def replay_soap(self, body):
+        interaction = self._replay(self._key('soap', body), "SOAP request {}".format(body[:200]))
+        return _CassetteHTTPResponse(interaction['status'],
+                                     interaction['reason'],
+                                     interaction['headers'],
+                                     base64.b64decode(interaction['body']))
+
+    # ESXi (SSH)
+
+    def wrap_ssh_client(self, host_name, client):
+        if self.mode == 'record':
+            return _RecordingSSHClient(self, host_name, client)
+        return _ReplaySSHClient(self, host_name)
+
+    def record_ssh(self, host_name, command, stdout, stderr, elapsed):
+        self._record(self._key('ssh', host_name, command), elapsed,
+                     stdout=base64.b64encode(stdout).decode('ascii'),
+                     stderr=base64.b64encode(stderr).decode('ascii'))
+
+    def replay_ssh(self, host_name, command):
+        interaction = self._replay(self._key('ssh', host_name, command), "'{}' on {}".format(command, host_name))
+        return base64.b64decode(interaction['stdout']), base64.b64decode(interaction['stderr'])
+
+
+class _CassetteHTTPResponse(object):
+    """
+    Just enough of httplib.HTTPResponse for the pyVmomi stub to deserialize from
+    """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = [tuple(header) for header in headers]
+        self.fd = io.BytesIO(body)
+
+    def getheader(self, name, default=None):
+        for header, value in self.headers:
+            if header.lower() == name.lower():
+                return value
+        return default
+
+    def getheaders(self):
+        return self.headers
+
+    def read(self, amt=None):
+        if amt is None:
+            return self.fd.read()
+        return self.fd.read(amt)
+
+
+class _RecordingHTTPConnection(object):
+
+    def __init__(self, cassette, connection):
+        self.cassette = cassette
+        self.connection = connection
+        self.body = None
+        self.started = None
+
+    def request(self, method, url, body=None, headers={}):
+        self.body = body
+        self.started = time.time()
+        self.connection.request(method, url, body, headers)
+
+    def getresponse(self):
+        response = self.connection.getresponse()
+        data = response.read()
+        elapsed = time.time() - self.started
+        headers = response.getheaders()
+        self.cassette.record_soap(self.body, response.status, response.reason, headers, data, elapsed)
+        return _CassetteHTTPResponse(response.status, response.reason, headers, data)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class _ReplayHTTPConnection(object):
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.body = None
+
+    def connect(self):
+        pass
+
+    def request(self, method, url, body=None, headers={}):
+        self.body = body
+
+    def getresponse(self):
+        return self.cassette.replay_soap(self.body)
+
+    def close(self):
+        pass
+
+
+class _RecordingSSHClient(object):
+
+    def __init__(self, cassette, host_name, client):
+        self.cassette = cassette
+        self.host_name = host_name
+        self.client = client
+
+    def exec_command(self, command, **kwargs):
+        started = time.time()
+        stdin, stdout, stderr = self.client.exec_command(command, **kwargs)
+        stdout_data = stdout.read()
+        stderr_data = stderr.read()
+        self.cassette.record_ssh(self.host_name, command, stdout_data, stderr_data, time.time() - started)
+        return stdin, io.BytesIO(stdout_data), io.BytesIO(stderr_data)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class _ReplaySSHClient(object):
+
+    def __init__(self, cassette, host_name):
+        self.cassette = cassette
+        self.host_name = host_name
+
+    def exec_command(self, command, **kwargs):
+        stdout_data, stderr_data = self.cassette.replay_ssh(self.host_name, command)
+        return None, io.BytesIO(stdout_data), io.BytesIO(stderr_data)
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
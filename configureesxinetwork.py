@@ -12,8 +12,14 @@ import sys
 import atexit
 import json
 import os
+import multiprocessing
+import multiprocessing.util
+import threading
+import Queue
 
 import vmware
+import cassette
+import journal
 
 from pyVim import connect
 from pyVmomi import vim
@@ -24,6 +30,8 @@ import time
 import re
 import ast
 
+# --time_budget counts from here so vCenter login and host lookups are paid out of the same budget
+PROCESS_STARTED = time.time()
 
 
 class ConfigureESXiNetwork():
@@ -52,6 +60,23 @@ class ConfigureESXiNetwork():
             type=str,
             default='myesxhostname.domain.com')
 
+        parser.add_argument(
+            '--hostnames',
+            type=str,
+            default='',
+            help='comma separated list of hosts; overrides --hostname')
+
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='number of worker processes to shard --hostnames across')
+
+        parser.add_argument(
+            '--region',
+            type=str,
+            default='')
+
         parser.add_argument(
             '--esxi_user',
             type=str,
@@ -87,33 +112,125 @@ class ConfigureESXiNetwork():
             type=str,
             default='audit')
 
+        parser.add_argument(
+            '--cassette',
+            type=str,
+            default='',
+            help='cassette file to record vCenter/ESXi traffic to or replay it from')
+
+        parser.add_argument(
+            '--cassette_mode',
+            type=str,
+            default='replay',
+            help="'record' or 'replay'; record needs --processes 1")
+
+        parser.add_argument(
+            '--latency_scale',
+            type=float,
+            default=None,
+            help='replay recorded latencies scaled by this factor; omit to replay without delay')
+
+        parser.add_argument(
+            '--journal',
+            type=str,
+            default='',
+            help='append-only file recording per-host step completion')
+
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='continue the run recorded in --journal, skipping completed steps')
+
+        parser.add_argument(
+            '--time_budget',
+            type=float,
+            default=0,
+            help='seconds an audit may take from process start, login included; probes still running at the deadline are abandoned and a partial profile is reported')
+
+        parser.add_argument(
+            '--meter_transport',
+            action='store_true',
+            help='count bytes on the wire per SOAP method')
+
+        parser.add_argument(
+            '--adaptive_concurrency',
+            action='store_true',
+            help='adapt concurrent SOAP calls, tasks and SSH sessions to vCenter and host latency')
+
         args = parser.parse_args()
 
         self.vc_userid = args.vc_userid
         self.vc_passwd = args.vc_passwd
         self.vc_fqdn = args.vc_fqdn
         self.hostname = args.hostname
+        self.hostnames = [name.strip() for name in args.hostnames.split(',') if name.strip()] or [self.hostname]
+        self.processes = args.processes
+        self.esxi_user = args.esxi_user
+        self.esxi_password = args.esxi_password
         self.action = args.action
         self.region = args.region
         self.vmnic_primary = args.primary_nic
         self.vmnic_secondary = args.secondary_nic
         self.name = "configureesxinetwork.py" 
         self.prod_extended_networks = args.networks
-        self.vswitch_name = args.vswtich
- 
-
+        self.vswitch_name = args.vswitch
+        self.cassette_path = args.cassette
+        self.cassette_mode = args.cassette_mode
+        self.latency_scale = args.latency_scale
+        self.meter_transport = args.meter_transport
+        self.adaptive_concurrency = args.adaptive_concurrency
+        self.journal_path = args.journal
+        self.resume = args.resume
+        self.journal = None
+        self.time_budget = args.time_budget
+        self.profile_partial = False
+        self.profile_confidence = 1.0
+        self.vc_connection = None
+
+        if self.cassette_path and self.cassette_mode == 'record' and self.is_sharded():
+            # every worker process records its own share of the traffic and would save it over the same file
+            raise Exception("--cassette_mode record needs a single process, run it with --processes 1")
+
+        # vCenter is logged into by run_host: under the deadline for budgeted audits, once per worker when sharding
+
+    def is_sharded(self):
+        return self.processes > 1 and len(self.hostnames) > 1
+
+    def connect(self):
+        if self.vc_connection is None:
+            self.vc_connection = self.open_connection()
+
+    def open_connection(self):
+        """
+        Logs into vCenter and returns the vmware.VMWare instance without keeping it, so a login abandoned at the
+        deadline cannot replace the connection later
+        """
+        tape = None
+        if self.cassette_path:
+            tape = cassette.Cassette(self.cassette_path, mode=self.cassette_mode, latency_scale=self.latency_scale)
         try:
-            self.vc_connection = vmware.VMWare(vc_userid=self.vc_userid, vc_passwd= self.vc_passwd, vc_fqdn= self.vc_fqdn) # Create a vcenter connection
-            message = "Successfully connected to {} as {}".format(self.vc_connection.vc_fqdn, self.vc_connection.vc_userid)
+            vc_connection = vmware.VMWare(vc_userid=self.vc_userid, vc_passwd= self.vc_passwd, vc_fqdn= self.vc_fqdn,
+                                          esxi_user=self.esxi_user, esxi_password=self.esxi_password,
+                                          cassette=tape, meter_transport=self.meter_transport,
+                                          adaptive_concurrency=self.adaptive_concurrency) # Create a vcenter connection
+            message = "Successfully connected to {} as {}".format(vc_connection.vc_fqdn, vc_connection.vc_userid)
             print(message)
+            return vc_connection
 
         except Exception as e:
             message = "Could not connect to vCenter in region and find the supplied host {}: {}".format(self.region, e)
-            sys.exit()
+            # raised rather than sys.exit(): a SystemExit inside a pool worker kills it and the pool respawns it forever
+            raise Exception(message)
 
 
+    def find_esxi_host(self, hostname):
+        esxihost = self.vc_connection.find_esxi_host(hostname)
+        if esxihost is None:
+            raise Exception("host {} not found in vCenter {}".format(hostname, self.vc_connection.vc_fqdn))
+        return esxihost
+
     def collect_network_info(self):
-        self.esxihost = self.vc_connection.get_host_by_name(self.hostname)
+        self.esxihost = self.find_esxi_host(self.hostname)
         self.host_network_system = self.esxihost.configManager.networkSystem
         self.uplinkset ="{},{}".format(self.vmnic_primary, self.vmnic_secondary)
         self.bond_name_primary = self.vc_connection.get_bridge_esxi_host(self.esxihost, self.vmnic_primary)
@@ -124,19 +241,110 @@ class ConfigureESXiNetwork():
         self.vmk_interface_secondary_ip= self.vc_connection.get_vmk_interface_ip_esxi_host(self.esxihost, self.vmk_interface_secondary)
         self.vmk_interface_primary_subnet= self.vc_connection.get_vmk_interface_subnet_esxi_host(self.esxihost, self.vmk_interface_primary)
         self.vmk_interface_secondary_subnet= self.vc_connection.get_vmk_interface_subnet_esxi_host(self.esxihost, self.vmk_interface_secondary)
-        self.vswitches = self.vc_connection.get_vswitches(self.host_network_system)
+        self.network_config = self.vc_connection.get_host_network_config(self.esxihost)
+        self.vswitches = self.network_config['vswitches'].values() if self.network_config else []
 
     def get_current_profile(self):
         self.collect_network_info()
-        profile = None
+        self.check_vswitch_configured()
+        return self.classify_profile()
+
+    def check_vswitch_configured(self):
         self.vswitch_configured = False
-        for vswitch in self.vswitches:
-            if vswitch.name == self.vswitch_name:
-                print "{} vswitch found".format(self.vswitch_name)
-                self.vswitch_configured = True
-                break
-            else:
-                print "migration switch not found"
+        if self.network_config and self.vswitch_name in self.network_config['vswitches']:
+            print "{} vswitch found".format(self.vswitch_name)
+            self.vswitch_configured = True
+        else:
+            print "migration switch not found"
+
+    def run_probe(self, name, probe, deadline):
+        """
+        Runs probe in a daemon thread and waits for it until the deadline at most.
+        Returns (True, result) if it finished in time, otherwise (False, None); a probe still running
+        at the deadline is abandoned and its result discarded.
+        """
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            message = "no time left for probe '{}' on host {}".format(name, self.hostname)
+            print(message)
+            return False, None
+        results = Queue.Queue()
+
+        def target():
+            try:
+                results.put((True, probe()))
+            except Exception as e:
+                results.put((False, e))
+        worker = threading.Thread(target=target, name="probe-{}".format(name))
+        worker.daemon = True
+        worker.start()
+        try:
+            completed, result = results.get(timeout=remaining)
+        except Queue.Empty:
+            message = "probe '{}' on host {} abandoned at the deadline".format(name, self.hostname)
+            print(message)
+            return False, None
+        if not completed:
+            message = "probe '{}' on host {} failed: {}".format(name, self.hostname, result)
+            print(message)
+            return False, None
+        return True, result
+
+    def get_budgeted_profile(self, budget):
+        """
+        Audits within budget seconds, cheapest high-value probes first: the vCenter login, host lookup and vswitch
+        presence from one property collector call, then the NSX vmk interface of each vmnic over SSH. Whatever did not
+        finish is treated as absent, and self.profile_partial / self.profile_confidence say how much of the answer is
+        backed by data.
+        """
+        deadline = time.time() + budget
+        hostname = self.hostname
+        self.vswitch_configured = False
+        self.vmk_interface_primary = None
+        self.vmk_interface_secondary = None
+        confidence = 0.0
+
+        if self.vc_connection is None:
+            completed, result = self.run_probe('login', self.open_connection, deadline)
+            if not completed:
+                self.profile_confidence = confidence
+                self.profile_partial = True
+                return None
+            self.vc_connection = result
+
+        def probe_vswitch():
+            # same lookup as the unbudgeted audit, so a hostname resolves the same way in both
+            esxihost = self.find_esxi_host(hostname)
+            return esxihost, self.vc_connection.get_host_network_config(esxihost)
+
+        completed, result = self.run_probe('vswitch', probe_vswitch, deadline)
+        if not completed:
+            self.profile_confidence = confidence
+            self.profile_partial = True
+            return None
+        self.esxihost, self.network_config = result
+        self.check_vswitch_configured()
+        confidence += 0.5
+
+        esxihost = self.esxihost
+        completed, result = self.run_probe('vmk_interface_primary',
+                                           lambda: self.vc_connection.get_production_vmk_interface_esxi_host(esxihost, self.vmnic_primary),
+                                           deadline)
+        if completed:
+            self.vmk_interface_primary = result
+            confidence += 0.25
+        completed, result = self.run_probe('vmk_interface_secondary',
+                                           lambda: self.vc_connection.get_production_vmk_interface_esxi_host(esxihost, self.vmnic_secondary),
+                                           deadline)
+        if completed:
+            self.vmk_interface_secondary = result
+            confidence += 0.25
+        self.profile_confidence = confidence
+        self.profile_partial = confidence < 1.0
+        return self.classify_profile()
+
+    def classify_profile(self):
+        profile = None
         if (self.vmk_interface_primary and self.vmk_interface_secondary and not self.vswitch_configured):
             print "both intrerfaces are set in NSX, and no virtual vsphere switch detected.  Host fully managed by NSX"
             profile = 'sdn'
@@ -161,39 +369,47 @@ class ConfigureESXiNetwork():
         vswitch_name=self.vswitch_name
         hostname=self.hostname
         try:
-            esxihost = self.vc_connection.get_host_by_name(hostname)
-            host_network_system = esxihost.configManager.networkSystem
-            self.vc_connection.create_vswitch(host_network_system, vswitch_name, num_ports, vmnicname)
+            # host and network system were looked up by the audit that precedes every update
+            self.vc_connection.create_vswitch(self.host_network_system, vswitch_name, num_ports, vmnicname)
 
-            message = "found esxi host {} in the virtual center {} and configured switch".format(esxihost, self.vc_connection.vc_fqdn)
+            message = "found esxi host {} in the virtual center {} and configured switch".format(self.esxihost, self.vc_connection.vc_fqdn)
             print(message)
+            return True
 
         except Exception as e:
             message = "Unable to configure vswtich on host {}: {}".format(hostname, e)
             print(message)
+            return False
 
     def delete_vswitch(self):
         vswitch_name=self.vswitch_name
         hostname=self.hostname
         try:
-            esxihost = self.vc_connection.get_host_by_name(hostname)
-            host_network_system = esxihost.configManager.networkSystem
-            self.vc_connection.delete_vswitch(host_network_system, vswitch_name)
+            self.vc_connection.delete_vswitch(self.host_network_system, vswitch_name)
 
-            message = "found esxi host {} in the virtual center {} and removed switch".format(esxihost, self.vc_connection.vc_fqdn)
+            message = "found esxi host {} in the virtual center {} and removed switch".format(self.esxihost, self.vc_connection.vc_fqdn)
             print(message)
+            return True
 
         except Exception as e:
             message = "Unable to remove vswtich on host {}: {}".format(hostname, e)
             print(message)
+            return False
 
 
     def assign_prod_portgroups(self):
     	vswitch_name=self.vswitch_name
         if self.vswitch_configured:
+            added_all = True
+            # port groups already on the vswitch were added by a run that died before journaling the step
+            existing = self.network_config['portgroups'] if self.network_config else {}
             for key in self.prod_extended_networks:
                 vlanid = key
                 pg_name = self.prod_extended_networks[key]
+                if pg_name in existing and existing[pg_name].spec.vswitchName == vswitch_name:
+                    message = "port group {} already on vswitch {}, skipping".format(pg_name, vswitch_name)
+                    print(message)
+                    continue
                 try:
                     self.vc_connection.create_port_group(self.host_network_system, pg_name, vlanid, vswitch_name)
                     message = "added vlanid {} with port group label {}".format(vlanid, pg_name)
@@ -201,43 +417,48 @@ class ConfigureESXiNetwork():
                 except Exception as e:
                     message = "Unable to add vlan {}: {}".format(vlanid, e)
                     print(message)
+                    added_all = False
+            return added_all
         else:
-            message = "Unable to find vswitch {}, check virtual center. Error thown: {}".format(vswitch_name, e)
+            message = "Unable to find vswitch {}, check virtual center.".format(vswitch_name)
             print(message)
+            return False
 
 
-    
-    def run(self):
-        if self.action == 'audit':
-            message = "auditing host {} for a network profile".format(self.hostname)
-            print(message)
-            print "{}\n".format(message)
-            profile_state = self.get_current_profile()
-            message = "audit complete on host {}, currently configured as '{}'".format(self.hostname, profile_state)
-            print(message)
-            print "{}\n".format(message)
 
-        elif self.action == 'update':
-            message = "auditing host {} for a network profile".format(self.hostname)
-            print(message)
-            print "{}\n".format(message)
-            profile_state = self.get_current_profile()
-            message = "audit complete on host {}, currently configured as '{}'".format(self.hostname, profile_state)
-            print(message)
-            print "{}\n".format(message)
+    def apply_update(self):
+        """
+        Runs the update steps not yet journaled for this host. A step is journaled only once it reported success;
+        the first failing step raises so nothing after it runs and the caller can roll back.
+        """
+        if not self.step_done('bond_destroyed'):
             message = "breaking the bond if exists "
             print(message)
             print "{}\n".format(message)
+            destroyed = True
             if self.bond_name_primary:
-                self.vc_connection.destroy_bond_esxi_host(self.esxihost, self.bond_name_primary)
+                destroyed = self.vc_connection.destroy_bond_esxi_host(self.esxihost, self.bond_name_primary) and destroyed
             if self.bond_name_secondary and self.bond_name_primary != self.bond_name_secondary:
-                self.vc_connection.destroy_bond_esxi_host(self.esxihost, self.bond_name_secondary)
+                destroyed = self.vc_connection.destroy_bond_esxi_host(self.esxihost, self.bond_name_secondary) and destroyed
+            if not destroyed:
+                raise Exception("unable to destroy the NSX bonds on host {}".format(self.hostname))
+            self.record_step('bond_destroyed', bonds=[self.bond_name_primary, self.bond_name_secondary])
+        if not self.step_done('vswitch_deleted'):
             if self.vswitch_configured:
                 message = "deleting vswitch from vsphere"
                 print(message)
                 print "{}\n".format(message)
-                self.delete_vswitch()
-
+                if not self.delete_vswitch():
+                    raise Exception("unable to delete vswitch {} on host {}".format(self.vswitch_name, self.hostname))
+                self.vswitch_configured = False
+                # its port groups went with it; keep the audited config in step with the host
+                if self.network_config:
+                    self.network_config['vswitches'].pop(self.vswitch_name, None)
+                    self.network_config['portgroups'] = dict((name, portgroup) for name, portgroup in self.network_config['portgroups'].items()
+                                                             if portgroup.spec.vswitchName != self.vswitch_name)
+            self.record_step('vswitch_deleted')
+
+        if not self.step_done('vswitch_created'):
             message = "setting vsphere switch"
             print(message)
             print "{}\n".format(message)
@@ -245,30 +466,227 @@ class ConfigureESXiNetwork():
             niclist = list()
             niclist.append(self.vmnic_primary)
             niclist.append(self.vmnic_secondary)
-            self.create_vswitch(niclist)
+            if self.vswitch_configured:
+                # vswitch_deleted is journaled, so this is the switch a run that died before journaling created
+                message = "vswitch {} already present on host {}, skipping".format(self.vswitch_name, self.hostname)
+                print(message)
+            elif not self.create_vswitch(niclist):
+                raise Exception("unable to create vswitch {} on host {}".format(self.vswitch_name, self.hostname))
+            self.vswitch_configured = True
+            self.record_step('vswitch_created')
+        if not self.step_done('portgroups_added'):
             message = "adding networks to vswitch"
             print(message)
             print "{}\n".format(message)
-            self.assign_prod_portgroups()
-            message = "checking state"
+            if not self.assign_prod_portgroups():
+                raise Exception("unable to add every port group to vswitch {} on host {}".format(self.vswitch_name, self.hostname))
+            self.record_step('portgroups_added')
+
+    def get_nsx_bond_state(self):
+        """
+        Returns {bond: {'uplinks', 'interface', 'ip', 'subnet'}} for the bonds found by the last audit
+        """
+        bonds = {}
+        for vmnic, bond, interface, ip, subnet in ((self.vmnic_primary, self.bond_name_primary, self.vmk_interface_primary,
+                                                    self.vmk_interface_primary_ip, self.vmk_interface_primary_subnet),
+                                                   (self.vmnic_secondary, self.bond_name_secondary, self.vmk_interface_secondary,
+                                                    self.vmk_interface_secondary_ip, self.vmk_interface_secondary_subnet)):
+            if not bond:
+                continue
+            state = bonds.setdefault(bond, {'uplinks': [], 'interface': None, 'ip': None, 'subnet': None})
+            state['uplinks'].append(vmnic)
+            if interface and not state['interface']:
+                state['interface'] = interface
+                state['ip'] = ip
+                state['subnet'] = subnet
+        return bonds
+
+    def take_network_snapshot(self):
+        self.network_snapshot = None
+        if self.step_done('bond_destroyed'):
+            message = "host {} was partially updated by an earlier run, no pre-change snapshot available".format(self.hostname)
+            print(message)
+            return
+        self.network_snapshot = {'network': self.vc_connection.get_network_snapshot(self.host_network_system),
+                                 'bonds': self.get_nsx_bond_state()}
+
+    def rollback(self):
+        """
+        Restores the pre-change snapshot: vswitches and port groups in one call, then the NSX bonds and uplinks
+        """
+        if not self.network_snapshot:
+            message = "no pre-change snapshot for host {}, unable to roll back".format(self.hostname)
+            print(message)
+            return False
+        started = time.time()
+        message = "rolling back network configuration on host {}".format(self.hostname)
+        print(message)
+        restored = True
+        try:
+            self.vc_connection.restore_network_snapshot(self.host_network_system, self.network_snapshot['network'],
+                                                        changed_vswitches=[self.vswitch_name])
+        except Exception as e:
+            message = "unable to restore vswitches and port groups on host {}: {}".format(self.hostname, e)
+            print(message)
+            restored = False
+        bonds = self.network_snapshot['bonds']
+        for bond in bonds:
+            state = bonds[bond]
+            if self.vc_connection.get_bridge_esxi_host(self.esxihost, state['uplinks'][0]) == bond:
+                continue
+            if not self.vc_connection.create_bond_esxi_host(self.esxihost, bond, ",".join(state['uplinks'])):
+                restored = False
+                continue
+            if state['interface'] and state['ip']:
+                if not self.vc_connection.set_interface_uplink_esxi_host(self.esxihost, state['interface'], state['ip'], state['subnet']):
+                    restored = False
+            if state['interface']:
+                if not self.vc_connection.connect_uplink_esxi_host(self.esxihost, state['interface']):
+                    restored = False
+        if not restored:
+            # the journal keeps the applied steps so the host can be inspected and resumed from where it stands
+            message = "rollback on host {} failed, host left partially restored".format(self.hostname)
+            print(message)
+            return False
+        if self.journal is not None:
+            self.journal.reset(self.hostname)
+        message = "rollback on host {} completed in {:.1f} seconds".format(self.hostname, time.time() - started)
+        print(message)
+        return True
+
+    def open_journal(self, resume):
+        if self.journal_path:
+            self.journal = journal.RunJournal(self.journal_path, resume=resume)
+
+    def step_done(self, step):
+        return self.journal is not None and self.journal.is_done(self.hostname, step)
+
+    def record_step(self, step, **details):
+        if self.journal is not None:
+            self.journal.record(self.hostname, step, **details)
+
+    def run(self):
+        self.open_journal(self.resume)
+        if self.is_sharded():
+            return self.run_sharded()
+        result = self.run_host()
+        if self.adaptive_concurrency and self.vc_connection is not None:
+            message = "concurrency limits: {}".format(json.dumps(self.vc_connection.get_concurrency_metrics()))
+            print(message)
+        return result
+
+    def run_sharded(self):
+        """
+        Shards self.hostnames across worker processes, each with its own vCenter session and SSH pool,
+        and merges the per-host results as they stream back
+        """
+        processes = min(self.processes, len(self.hostnames))
+        message = "running '{}' on {} hosts across {} worker processes".format(self.action, len(self.hostnames), processes)
+        print(message)
+        results = {}
+        pool = multiprocessing.Pool(processes=processes, initializer=_init_worker)
+        try:
+            for hostname, result in pool.imap_unordered(_run_worker_host, self.hostnames):
+                results[hostname] = result
+                message = "host {} finished with result '{}'".format(hostname, result)
+                print(message)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    def run_host(self):
+        if self.action == 'audit':
+            if self.step_done('audited'):
+                profile_state = self.journal.get(self.hostname, 'audited')['profile']
+                message = "host {} already audited in journal, currently configured as '{}'".format(self.hostname, profile_state)
+                print(message)
+                return profile_state
+            message = "auditing host {} for a network profile".format(self.hostname)
+            print(message)
+            print "{}\n".format(message)
+            if self.time_budget:
+                profile_state = self.get_budgeted_profile(PROCESS_STARTED + self.time_budget - time.time())
+            else:
+                self.connect()
+                profile_state = self.get_current_profile()
+            message = "audit complete on host {}, currently configured as '{}'".format(self.hostname, profile_state)
+            if self.profile_partial:
+                message = "{} (partial, confidence {:.2f})".format(message, self.profile_confidence)
+            print(message)
+            print "{}\n".format(message)
+            if not self.profile_partial:
+                self.record_step('audited', profile=profile_state)
+            return profile_state
+
+        elif self.action == 'update':
+            if self.step_done('verified'):
+                message = "host {} already updated and verified in journal, skipping".format(self.hostname)
+                print(message)
+                return True
+            self.connect()
+            message = "auditing host {} for a network profile".format(self.hostname)
             print(message)
             print "{}\n".format(message)
             profile_state = self.get_current_profile()
+            message = "audit complete on host {}, currently configured as '{}'".format(self.hostname, profile_state)
+            print(message)
+            print "{}\n".format(message)
+            self.take_network_snapshot()
+            try:
+                self.apply_update()
+                message = "checking state"
+                print(message)
+                print "{}\n".format(message)
+                profile_state = self.get_current_profile()
+            except Exception as e:
+                message = "update failed on host {}: {}".format(self.hostname, e)
+                print(message)
+                profile_state = None
             if profile_state == 'physical':
                 message = "config completed without issue"
                 print(message)
                 print "{}\n".format(message)
+                self.record_step('verified', profile=profile_state)
                 return True
             else:
                 message = "State Does not match"
                 print(message)
                 print "{}\n".format(message)
+                self.rollback()
                 return False
         else:
             message = "Please use 'update' or 'audit' for the action type type, action submitted: {} network profile".format(self.action)
             print(message)
             print "{}\n".format(message)
 
+_worker_hostconfig = None
+
+def _init_worker():
+    # runs once per worker process: own argument parse. The vCenter session and SSH pool are opened by the
+    # first task so a failed login comes back as that host's result instead of killing the worker
+    global _worker_hostconfig
+    _worker_hostconfig = ConfigureESXiNetwork()
+    _worker_hostconfig.processes = 1
+    # the parent already started (or is resuming) the run in the journal
+    _worker_hostconfig.open_journal(resume=True)
+    # pool workers leave through os._exit, so atexit handlers never log out their sessions
+    multiprocessing.util.Finalize(None, _close_worker, exitpriority=10)
+
+def _close_worker():
+    if _worker_hostconfig.vc_connection is not None:
+        _worker_hostconfig.vc_connection.close()
+
+def _run_worker_host(hostname):
+    _worker_hostconfig.hostname = hostname
+    try:
+        return hostname, _worker_hostconfig.run_host()
+    except Exception as e:
+        return hostname, "error: {}".format(e)
+
 def main():
     try:
         hostconfig = ConfigureESXiNetwork()
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+
+class RunJournal(object):
+    """Append-only journal of per-host step completion for long fleet runs
+    Every completed step is appended as one JSON line and fsync'd, so a run killed at any point (vCenter restart,
+    reboot, Ctrl-C) leaves an accurate record. A new run appends a 'run_started' marker; resuming reads back the
+    steps recorded since the last marker so finished hosts are skipped and partial ones pick up at the next step.
+    Lines are written with a single append each, so worker processes can share one journal file.
+    Args:
+        path:    journal file, created if missing
+        resume:  True to continue the last run recorded in the file, False to start a new one
+
+    Example:
+        As Reference
+                run = journal.RunJournal('/var/tmp/esxi_update.journal', resume=True)
+                if not run.is_done('myesxhost.fqdn.domain.com', 'vswitch_created'):
+                    ...
+                    run.record('myesxhost.fqdn.domain.com', 'vswitch_created')
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = {}
+        self._end_torn_line()
+        if resume and os.path.exists(path):
+            self._load()
+            print "INFO: Resuming run from journal {}, {} hosts have recorded progress".format(path, len(self.completed))
+        elif not resume:
+            self._append({'event': 'run_started'})
+
+    def _end_torn_line(self):
+        # a run killed mid-write leaves a line without its newline; the next entry must not be appended onto it
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        with open(self.path, 'rb+') as fd:
+            fd.seek(-1, os.SEEK_END)
+            if fd.read(1) != b'\n':
+                fd.write(b'\n')
+                fd.flush()
+                os.fsync(fd.fileno())
+
+    def _load(self):
+        with open(self.path) as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn final line from a run killed mid-write
+                    continue
+                if entry.get('event') == 'run_started':
+                    self.completed = {}
+                elif entry.get('event') == 'step':
+                    self.completed.setdefault(entry['host'], {})[entry['step']] = entry
+                elif entry.get('event') == 'reset':
+                    self.completed.pop(entry['host'], None)
+
+    def _append(self, entry):
+        entry['ts'] = time.time()
+        with self.lock:
+            with open(self.path, 'a') as fd:
+                fd.write(json.dumps(entry) + '\n')
+                fd.flush()
+                os.fsync(fd.fileno())
+
+    def record(self, host, step, **details):
+        entry = {'event': 'step', 'host': host, 'step': step}
+        entry.update(details)
+        self._append(entry)
+        with self.lock:
+            self.completed.setdefault(host, {})[step] = entry
+
+    def reset(self, host):
+        """
+        Forgets every step recorded for host, e.g. after its changes were rolled back
+        """
+        self._append({'event': 'reset', 'host': host})
+        with self.lock:
+            self.completed.pop(host, None)
+
+    def is_done(self, host, step):
+        with self.lock:
+            return step in self.completed.get(host, {})
+
+    def get(self, host, step):
+        """
+        Returns the recorded entry (including any details passed to record) or None
+        """
+        with self.lock:
+            return self.completed.get(host, {}).get(step)
@@ -0,0 +1,146 @@
+import contextlib
+import httplib
+import socket
+import threading
+import time
+
+
+# long polls block by design; their latency says nothing about vCenter load
+LONG_POLL_METHODS = ('WaitForUpdates', 'WaitForUpdatesEx', 'WaitForTask')
+
+# failures that say the other end is overloaded or unreachable; API faults (NotFound, AlreadyExists, InvalidLogin...)
+# are answers, and count as completed calls with their latency
+TRANSPORT_ERRORS = (socket.error, httplib.HTTPException)
+
+
+class AdaptiveLimiter(object):
+    """AIMD concurrency limit that tracks how fast vCenter or an ESXi host is answering
+    Every call that completes under latency_threshold raises the limit by 1/limit (about +1 per limit's worth of
+    calls); a call that fails with a transport error or exceeds the threshold cuts it by backoff, at most once per
+    observed latency (and never more often than latency_threshold) so a burst of slow or failing calls counts as one
+    congestion signal. Callers block in acquire() while the limit is in use.
+    Args:
+        name:              label used in metrics
+        initial:           starting concurrency
+        minimum, maximum:  bounds for the limit
+        latency_threshold: seconds above which a call is treated as congestion
+        backoff:           multiplicative decrease applied on congestion
+
+    Example:
+        As Reference
+                soap = limiter.AdaptiveLimiter('soap', initial=4, maximum=32, latency_threshold=2.0)
+                with soap.slot():
+                    host_network_system.AddPortGroup(portgrp=port_group_spec)
+                soap.metrics()
+                    {'name': 'soap', 'limit': 5.2, 'inflight': 3, 'waiting': 0, 'latency': 0.41, ...}
+    """
+
+    def __init__(self, name, initial=4, minimum=1, maximum=32, latency_threshold=2.0, backoff=0.5, smoothing=0.2):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_threshold = latency_threshold
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.condition = threading.Condition()
+        self.limit = float(initial)
+        self.inflight = 0
+        self.waiting = 0
+        self.latency = None
+        self.last_backoff = 0.0
+        self.successes = 0
+        self.congestions = 0
+        self.backoffs = 0
+
+    def current_limit(self):
+        """
+        Number of calls allowed in flight right now
+        """
+        with self.condition:
+            return max(self.minimum, int(self.limit))
+
+    def acquire(self):
+        with self.condition:
+            self.waiting += 1
+            while self.inflight >= max(self.minimum, int(self.limit)):
+                self.condition.wait()
+            self.waiting -= 1
+            self.inflight += 1
+
+    def release(self, latency=None, success=True):
+        """
+        Frees the slot; latency (seconds) is fed to the controller unless None
+        """
+        with self.condition:
+            self.inflight -= 1
+            if latency is not None or not success:
+                self._observe(latency or 0.0, success)
+            self.condition.notify_all()
+
+    def observe(self, latency, success=True):
+        """
+        Feeds a latency signal that was measured outside a slot, e.g. how long a task sat queued in vCenter
+        """
+        with self.condition:
+            self._observe(latency, success)
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, measure=True, congestion=TRANSPORT_ERRORS):
+        """
+        Holds a slot for the block; exceptions of the congestion types count as congestion, any other exception
+        as a completed call
+        """
+        self.acquire()
+        started = time.time()
+        success = True
+        try:
+            yield
+        except congestion:
+            success = False
+            raise
+        finally:
+            self.release(time.time() - started if measure else None, success)
+
+    def _observe(self, latency, success):
+        now = time.time()
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        if success and latency <= self.latency_threshold:
+            self.successes += 1
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            return
+        self.congestions += 1
+        if now - self.last_backoff >= max(latency, self.latency, self.latency_threshold):
+            self.last_backoff = now
+            self.backoffs += 1
+            self.limit = max(self.minimum, self.limit * self.backoff)
+
+    def metrics(self):
+        with self.condition:
+            return {'name': self.name,
+                    'limit': round(self.limit, 2),
+                    'inflight': self.inflight,
+                    'waiting': self.waiting,
+                    'latency': round(self.latency, 3) if self.latency is not None else None,
+                    'successes': self.successes,
+                    'congestions': self.congestions,
+                    'backoffs': self.backoffs}
+
+
+def limit_stub(stub, limiter):
+    """
+    Routes every SOAP call made through a pyVmomi stub, except long polls, through the limiter.
+    Only InvokeMethod is wrapped: property accessors are sent through it as well.
+    """
+    invoke_method = stub.InvokeMethod
+
+    def limited_invoke_method(mo, info, args, *rest):
+        if info.name in LONG_POLL_METHODS:
+            return invoke_method(mo, info, args, *rest)
+        with limiter.slot():
+            return invoke_method(mo, info, args, *rest)
+
+    stub.InvokeMethod = limited_invoke_method
@@ -0,0 +1,115 @@
+import Queue
+import threading
+import time
+
+from pyVim import connect
+
+
+class VCenterSessionPool(object):
+    """Pool of authenticated vCenter sessions with checkout/checkin semantics for concurrent callers
+    A pyVmomi service instance (and its stub) must only be used by one thread at a time; the pool hands each
+    caller its own session so SOAP calls from different threads run in parallel against vCenter.
+    Sessions idle for longer than validate_after are checked before being handed out and logged in again
+    if vCenter expired them; a keepalive thread touches idle sessions every keepalive_interval seconds.
+    Args:
+        connect_func:       callable returning a new logged in service instance, e.g. VMWare._get_vcenter_connection
+        size:               number of sessions to open
+        keepalive_interval: seconds between keepalive calls on idle sessions, 0 disables the keepalive thread
+        validate_after:     seconds a session may sit idle before it is validated on checkout
+
+    Example:
+        As Reference
+                pool = sessionpool.VCenterSessionPool(y._get_vcenter_connection, size=4)
+                service_instance = pool.checkout()
+                    returns a session for this thread, blocking until one is free
+                pool.checkin(service_instance)
+                    hands it back for other threads
+    """
+
+    def __init__(self, connect_func, size, keepalive_interval=300, validate_after=60):
+        self.connect_func = connect_func
+        self.size = size
+        self.keepalive_interval = keepalive_interval
+        self.validate_after = validate_after
+        self.idle = Queue.Queue()
+        self.stopped = threading.Event()
+        print "INFO: Opening {} pooled vCenter sessions".format(size)
+        for _ in range(size):
+            self.idle.put((self.connect_func(), time.time()))
+        self.keepalive_thread = None
+        if keepalive_interval:
+            self.keepalive_thread = threading.Thread(target=self._keepalive, name='vcenter-session-keepalive')
+            self.keepalive_thread.daemon = True
+            self.keepalive_thread.start()
+
+    def checkout(self, timeout=None):
+        """
+        Returns a live session, blocking up to timeout seconds (forever when None) for one to be checked in
+        """
+        try:
+            service_instance, last_used = self.idle.get(timeout=timeout)
+        except Queue.Empty:
+            raise Exception("No vCenter session became available within {} seconds".format(timeout))
+        if time.time() - last_used > self.validate_after and not self._is_alive(service_instance):
+            try:
+                service_instance = self._relogin(service_instance)
+            except Exception:
+                # keep the slot: the stale session goes back with its old timestamp and is validated again next time
+                self.idle.put((service_instance, last_used))
+                raise
+        return service_instance
+
+    def checkin(self, service_instance):
+        self.idle.put((service_instance, time.time()))
+
+    def close(self):
+        """
+        Stops the keepalive thread and logs out every idle session
+        """
+        self.stopped.set()
+        while True:
+            try:
+                service_instance, _ = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                connect.Disconnect(service_instance)
+            except Exception:
+                pass
+
+    def _is_alive(self, service_instance):
+        try:
+            return service_instance.content.sessionManager.currentSession is not None
+        except Exception:
+            # NotAuthenticated once vCenter dropped the session, socket errors if the connection went away
+            return False
+
+    def _relogin(self, service_instance):
+        print "INFO: vCenter session expired, logging in again"
+        try:
+            connect.Disconnect(service_instance)
+        except Exception:
+            pass
+        return self.connect_func()
+
+    def _keepalive(self):
+        while not self.stopped.wait(self.keepalive_interval):
+            # only touch sessions that are idle right now; busy ones are being kept alive by their callers
+            for _ in range(self.idle.qsize()):
+                try:
+                    service_instance, last_used = self.idle.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    service_instance.CurrentTime()
+                    if not self._is_alive(service_instance):
+                        service_instance = self._relogin(service_instance)
+                    last_used = time.time()
+                except Exception:
+                    try:
+                        service_instance = self._relogin(service_instance)
+                        last_used = time.time()
+                    except Exception as ex:
+                        # leave last_used stale so the next checkout validates it again
+                        print "ERROR: unable to re-login pooled vCenter session: {}".format(ex)
+                self.idle.put((service_instance, last_used))
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyVmomi import vim
+from pyVmomi import SoapStubAdapter
+
+import cassette
+
+
+CURRENT_TIME_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soapenv:Body>
+<CurrentTimeResponse xmlns="urn:vim25"><returnval>2026-10-19T10:00:00.000000Z</returnval></CurrentTimeResponse>
+</soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class FakeVCenterConnection(object):
+    """
+    Stands in for the HTTPS connection to vCenter: answers every request with CurrentTimeResponse
+    """
+    requests = 0
+
+    def __init__(self, host, **kwargs):
+        self.host = host
+
+    def request(self, method, url, body=None, headers={}):
+        FakeVCenterConnection.requests += 1
+
+    def getresponse(self):
+        return cassette._CassetteHTTPResponse(200, 'OK', [('content-type', 'text/xml; charset=utf-8')],
+                                              CURRENT_TIME_RESPONSE)
+
+    def close(self):
+        pass
+
+
+class FakeSSHClient(object):
+
+    def exec_command(self, command, **kwargs):
+        return None, io.BytesIO(b'vmnic4'), io.BytesIO(b'')
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'audit.cassette')
+        FakeVCenterConnection.requests = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def connected_service_instance(self):
+        stub = SoapStubAdapter(host='vcenter.test', version='vim.version.version11')
+        stub.scheme = FakeVCenterConnection
+        service_instance = vim.ServiceInstance('ServiceInstance', stub)
+        # the login call leaves its connection in the stub's pool
+        service_instance.CurrentTime()
+        self.assertEqual(len(stub.pool), 1)
+        return service_instance
+
+    def test_record_then_replay_soap(self):
+        tape = cassette.Cassette(self.path, mode='record')
+        service_instance = self.connected_service_instance()
+        tape.attach(service_instance)
+        recorded_time = service_instance.CurrentTime()
+        service_instance.CurrentTime()
+        tape.save()
+        self.assertEqual(len(tape.interactions), 2)
+
+        requests_before_replay = FakeVCenterConnection.requests
+        replay = cassette.Cassette(self.path, mode='replay')
+        replayed = replay.get_service_instance('vcenter.test')
+        self.assertEqual(replayed.CurrentTime(), recorded_time)
+        self.assertEqual(replayed.CurrentTime(), recorded_time)
+        self.assertEqual(FakeVCenterConnection.requests, requests_before_replay)
+        self.assertRaises(cassette.CassetteError, replayed.CurrentTime)
+
+    def test_record_then_replay_ssh(self):
+        tape = cassette.Cassette(self.path, mode='record')
+        tape.meta['version'] = 'vim.version.version11'
+        client = tape.wrap_ssh_client('esx01', FakeSSHClient())
+        stdin, stdout, stderr = client.exec_command('esxcli network nic list')
+        self.assertEqual(stdout.read(), b'vmnic4')
+        tape.save()
+
+        replay = cassette.Cassette(self.path, mode='replay')
+        client = replay.wrap_ssh_client('esx01', None)
+        stdin, stdout, stderr = client.exec_command('esxcli network nic list')
+        self.assertEqual(stdout.read(), b'vmnic4')
+        self.assertEqual(stderr.read(), b'')
+        self.assertRaises(cassette.CassetteError, client.exec_command, 'esxcli network nic list')
+
+
+if __name__ == '__main__':
+    unittest.main()
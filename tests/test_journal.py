@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import journal
+
+
+class RunJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'update.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_reads_steps_of_the_last_run(self):
+        old_run = journal.RunJournal(self.path)
+        old_run.record('esx01', 'vswitch_created')
+        run = journal.RunJournal(self.path)
+        run.record('esx02', 'bond_destroyed', bonds=['nsx-bond0'])
+
+        resumed = journal.RunJournal(self.path, resume=True)
+        self.assertFalse(resumed.is_done('esx01', 'vswitch_created'))
+        self.assertTrue(resumed.is_done('esx02', 'bond_destroyed'))
+        self.assertEqual(resumed.get('esx02', 'bond_destroyed')['bonds'], ['nsx-bond0'])
+
+    def test_resume_skips_torn_final_line(self):
+        run = journal.RunJournal(self.path)
+        run.record('esx01', 'bond_destroyed')
+        with open(self.path, 'a') as fd:
+            fd.write('{"event": "step", "host": "esx01", "st')
+
+        resumed = journal.RunJournal(self.path, resume=True)
+        self.assertTrue(resumed.is_done('esx01', 'bond_destroyed'))
+        self.assertFalse(resumed.is_done('esx01', 'vswitch_deleted'))
+        resumed.record('esx01', 'vswitch_deleted')
+
+        resumed = journal.RunJournal(self.path, resume=True)
+        self.assertTrue(resumed.is_done('esx01', 'vswitch_deleted'))
+
+    def test_reset_forgets_host_across_resume(self):
+        run = journal.RunJournal(self.path)
+        run.record('esx01', 'bond_destroyed')
+        run.record('esx02', 'bond_destroyed')
+        run.reset('esx01')
+        self.assertFalse(run.is_done('esx01', 'bond_destroyed'))
+
+        resumed = journal.RunJournal(self.path, resume=True)
+        self.assertFalse(resumed.is_done('esx01', 'bond_destroyed'))
+        self.assertTrue(resumed.is_done('esx02', 'bond_destroyed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
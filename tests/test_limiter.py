@@ -0,0 +1,63 @@
+import socket
+import unittest
+
+from pyVmomi import vim
+
+import limiter
+
+
+class FakeMethodInfo(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeStub(object):
+    """
+    Answers every call with a NotFound fault, as vCenter does for a stale managed object reference
+    """
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        raise vim.fault.NotFound()
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def fail_in_slots(self, soap, error, count=5):
+        for _ in range(count):
+            try:
+                with soap.slot():
+                    raise error
+            except type(error):
+                pass
+
+    def test_api_faults_are_completed_calls(self):
+        soap = limiter.AdaptiveLimiter('soap', initial=8, maximum=32, latency_threshold=2.0)
+        self.fail_in_slots(soap, vim.fault.NotFound())
+        metrics = soap.metrics()
+        self.assertTrue(metrics['limit'] >= 8)
+        self.assertEqual(metrics['backoffs'], 0)
+        self.assertEqual(metrics['inflight'], 0)
+
+    def test_transport_errors_back_off_once_per_burst(self):
+        soap = limiter.AdaptiveLimiter('soap', initial=8, maximum=32, latency_threshold=2.0)
+        self.fail_in_slots(soap, socket.error('connection reset'))
+        metrics = soap.metrics()
+        self.assertEqual(metrics['limit'], 4)
+        self.assertEqual(metrics['backoffs'], 1)
+        self.assertEqual(metrics['congestions'], 5)
+
+    def test_limit_stub_releases_slot_on_fault(self):
+        soap = limiter.AdaptiveLimiter('soap', initial=2, maximum=32, latency_threshold=2.0)
+        stub = FakeStub()
+        limiter.limit_stub(stub, soap)
+        for _ in range(3):
+            self.assertRaises(vim.fault.NotFound, stub.InvokeMethod, None, FakeMethodInfo('RetrievePropertiesEx'), [])
+        metrics = soap.metrics()
+        self.assertEqual(metrics['inflight'], 0)
+        self.assertEqual(metrics['successes'], 3)
+        self.assertEqual(metrics['backoffs'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
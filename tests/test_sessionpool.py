@@ -0,0 +1,34 @@
+import unittest
+
+import sessionpool
+
+
+class ExpiredSession(object):
+    """
+    Stands in for a service instance whose session vCenter has dropped
+    """
+
+    @property
+    def content(self):
+        raise Exception('NotAuthenticated')
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def test_failed_relogin_keeps_the_slot(self):
+        logins = []
+
+        def connect():
+            if logins:
+                raise Exception('vCenter unavailable')
+            logins.append(ExpiredSession())
+            return logins[-1]
+
+        pool = sessionpool.VCenterSessionPool(connect, size=1, keepalive_interval=0, validate_after=-1)
+        self.assertRaises(Exception, pool.checkout, timeout=1)
+        self.assertRaises(Exception, pool.checkout, timeout=1)
+        self.assertEqual(pool.idle.qsize(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
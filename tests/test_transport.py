@@ -0,0 +1,32 @@
+import unittest
+
+from pyVmomi import vim
+from pyVmomi import SoapStubAdapter
+
+import transport
+from tests.test_cassette import FakeVCenterConnection, CURRENT_TIME_RESPONSE
+
+
+class TransportTest(unittest.TestCase):
+
+    def test_meters_calls_after_login(self):
+        stub = SoapStubAdapter(host='vcenter.test', version='vim.version.version11')
+        stub.scheme = FakeVCenterConnection
+        service_instance = vim.ServiceInstance('ServiceInstance', stub)
+        # the login call leaves its connection in the stub's pool
+        service_instance.CurrentTime()
+
+        stats = transport.TransportStats()
+        transport.meter_transport(service_instance, stats)
+        service_instance.CurrentTime()
+        service_instance.CurrentTime()
+
+        calls = stats.snapshot()
+        self.assertEqual(calls['CurrentTime']['calls'], 2)
+        self.assertEqual(calls['CurrentTime']['bytes_received'], 2 * len(CURRENT_TIME_RESPONSE))
+        self.assertTrue(calls['CurrentTime']['bytes_sent'] > 0)
+        self.assertEqual(stats.last_call['method'], 'CurrentTime')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import threading
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+
+class Topology(object):
+    """In-memory model of datacenter -> cluster -> host -> network/datastore for a vCenter
+    The whole graph is fetched with one traversal-spec based filter on a property collector of its own; refresh()
+    asks the same filter for what changed since the last version, so keeping the model current costs one small call.
+    Objects are keyed by managed object id internally; queries take and return inventory names.
+    Args:
+        service_instance: connected vCenter service instance; the filter lives in that session
+
+    Example:
+        As Reference
+                topo = topology.Topology(y.vc_connection)
+                topo.hosts_in_cluster('cluster01')
+                    returns HostSystem objects in the cluster
+                topo.clusters_with_network('v001_10-10-10-1_ShrdNet1')
+                    returns names of clusters with at least one host attached to the network
+                topo.host_cluster_map()
+                    returns {host name: cluster name}
+                topo.refresh()
+                    applies inventory changes since the last fetch
+    """
+
+    def __init__(self, service_instance):
+        self.service_instance = service_instance
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.version = ''
+        # a private collector: the session's default one is shared with wait_for_tasks and its own update versions
+        self.property_collector = service_instance.content.propertyCollector.CreatePropertyCollector()
+        self.property_filter = self._create_filter()
+        self.refresh()
+
+    def _create_filter(self):
+        content = self.service_instance.RetrieveContent()
+        TraversalSpec = vmodl.query.PropertyCollector.TraversalSpec
+        SelectionSpec = vmodl.query.PropertyCollector.SelectionSpec
+        PropertySpec = vmodl.query.PropertyCollector.PropertySpec
+
+        host_to_network = TraversalSpec(name='hostToNetwork', type=vim.HostSystem, path='network', skip=False)
+        host_to_datastore = TraversalSpec(name='hostToDatastore', type=vim.HostSystem, path='datastore', skip=False)
+        compute_to_host = TraversalSpec(name='computeToHost', type=vim.ComputeResource, path='host', skip=False,
+                                        selectSet=[host_to_network, host_to_datastore])
+        datacenter_to_host_folder = TraversalSpec(name='datacenterToHostFolder', type=vim.Datacenter, path='hostFolder',
+                                                  skip=False, selectSet=[SelectionSpec(name='folderToChild')])
+        folder_to_child = TraversalSpec(name='folderToChild', type=vim.Folder, path='childEntity', skip=False,
+                                        selectSet=[SelectionSpec(name='folderToChild'),
+                                                   datacenter_to_host_folder,
+                                                   compute_to_host])
+
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=content.rootFolder, skip=False, selectSet=[folder_to_child])
+        property_specs = [PropertySpec(type=vim.Folder, pathSet=['name', 'parent']),
+                          PropertySpec(type=vim.Datacenter, pathSet=['name', 'parent']),
+                          PropertySpec(type=vim.ComputeResource, pathSet=['name', 'parent', 'host']),
+                          PropertySpec(type=vim.HostSystem, pathSet=['name', 'parent', 'network', 'datastore']),
+                          PropertySpec(type=vim.Network, pathSet=['name']),
+                          PropertySpec(type=vim.Datastore, pathSet=['name'])]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=property_specs)
+        return self.property_collector.CreateFilter(filter_spec, partialUpdates=False)
+
+    def refresh(self):
+        """
+        Applies every inventory change since the last refresh; the first call loads the whole graph
+        """
+        property_collector = self.property_collector
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        with self.lock:
+            update = property_collector.WaitForUpdatesEx(self.version, options)
+            while update:
+                for filter_set in update.filterSet:
+                    if filter_set.filter != self.property_filter:
+                        continue
+                    for obj_set in filter_set.objectSet:
+                        self._apply(obj_set)
+                self.version = update.version
+                if not update.truncated:
+                    break
+                update = property_collector.WaitForUpdatesEx(self.version, options)
+
+    def _apply(self, obj_set):
+        moid = obj_set.obj._moId
+        if obj_set.kind == 'leave':
+            self.objects.pop(moid, None)
+            return
+        entry = self.objects.setdefault(moid, {'obj': obj_set.obj, 'props': {}})
+        for change in obj_set.changeSet:
+            if change.op in ('remove', 'indirectRemove'):
+                entry['props'].pop(change.name, None)
+            else:
+                entry['props'][change.name] = change.val
+
+    def close(self):
+        """
+        Destroys the filter and the private collector; later calls do nothing
+        """
+        with self.lock:
+            if self.property_collector is None:
+                return
+            property_collector, self.property_collector = self.property_collector, None
+            self.property_filter.Destroy()
+            property_collector.DestroyPropertyCollector()
+
+    def _of_type(self, vimtype):
+        return [entry for entry in self.objects.values() if isinstance(entry['obj'], vimtype)]
+
+    def _find(self, vimtype, name):
+        for entry in self._of_type(vimtype):
+            if entry['props'].get('name') == name:
+                return entry
+        return None
+
+    def _name(self, obj):
+        entry = self.objects.get(obj._moId) if obj is not None else None
+        return entry['props'].get('name') if entry else None
+
+    def _datacenter_of(self, obj):
+        entry = self.objects.get(obj._moId)
+        while entry:
+            if isinstance(entry['obj'], vim.Datacenter):
+                return entry['props'].get('name')
+            parent = entry['props'].get('parent')
+            entry = self.objects.get(parent._moId) if parent is not None else None
+        return None
+
+    def datacenters(self):
+        with self.lock:
+            return [entry['props'].get('name') for entry in self._of_type(vim.Datacenter)]
+
+    def clusters(self, datacenter_name=None):
+        with self.lock:
+            return [entry['props'].get('name') for entry in self._of_type(vim.ClusterComputeResource)
+                    if datacenter_name is None or self._datacenter_of(entry['obj']) == datacenter_name]
+
+    def cluster_objects(self):
+        with self.lock:
+            return [entry['obj'] for entry in self._of_type(vim.ClusterComputeResource)]
+
+    def hosts_in_cluster(self, cluster_name):
+        with self.lock:
+            cluster = self._find(vim.ClusterComputeResource, cluster_name)
+            if not cluster:
+                return []
+            return list(cluster['props'].get('host') or [])
+
+    def host_cluster_map(self):
+        """
+        Returns {host name: cluster name}; standalone hosts map to None
+        """
+        with self.lock:
+            mapping = {}
+            for entry in self._of_type(vim.HostSystem):
+                parent = entry['props'].get('parent')
+                cluster_name = None
+                if isinstance(parent, vim.ClusterComputeResource):
+                    cluster_name = self._name(parent)
+                mapping[entry['props'].get('name')] = cluster_name
+            return mapping
+
+    def cluster_of_host(self, host_name):
+        return self.host_cluster_map().get(host_name)
+
+    def networks_of_host(self, host_name):
+        with self.lock:
+            host = self._find(vim.HostSystem, host_name)
+            if not host:
+                return []
+            return [self._name(network) for network in host['props'].get('network') or []]
+
+    def datastores_of_host(self, host_name):
+        with self.lock:
+            host = self._find(vim.HostSystem, host_name)
+            if not host:
+                return []
+            return [self._name(datastore) for datastore in host['props'].get('datastore') or []]
+
+    def clusters_with_network(self, network_name):
+        return self._clusters_with(network_name, 'network')
+
+    def clusters_with_datastore(self, datastore_name):
+        return self._clusters_with(datastore_name, 'datastore')
+
+    def _clusters_with(self, name, prop):
+        with self.lock:
+            clusters = set()
+            for entry in self._of_type(vim.HostSystem):
+                parent = entry['props'].get('parent')
+                if not isinstance(parent, vim.ClusterComputeResource):
+                    continue
+                if name in [self._name(obj) for obj in entry['props'].get(prop) or []]:
+                    clusters.add(self._name(parent))
+            return sorted(clusters)
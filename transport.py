@@ -0,0 +1,106 @@
+import re
+import threading
+import time
+
+
+SOAP_METHOD = re.compile(r'<soapenv:Body>\s*<(\w+)')
+
+
+class TransportStats(object):
+    """Bytes on the wire per SOAP method for every connection wrapped by meter_transport
+    Bytes received are counted before the stub decompresses them, so they reflect what actually crossed the network.
+
+    Example:
+        As Reference
+                stats = transport.TransportStats()
+                transport.meter_transport(service_instance, stats)
+                stats.snapshot()
+                    {'RetrievePropertiesEx': {'calls': 3, 'bytes_sent': 2310, 'bytes_received': 48211, 'seconds': 0.81}}
+                stats.last_call
+                    {'method': 'RetrievePropertiesEx', 'bytes_sent': 770, 'bytes_received': 16001, 'seconds': 0.27}
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.last_call = None
+
+    def add(self, method, bytes_sent, bytes_received, seconds):
+        with self.lock:
+            entry = self.methods.setdefault(method, {'calls': 0, 'bytes_sent': 0, 'bytes_received': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['bytes_sent'] += bytes_sent
+            entry['bytes_received'] += bytes_received
+            entry['seconds'] += seconds
+            self.last_call = {'method': method,
+                              'bytes_sent': bytes_sent,
+                              'bytes_received': bytes_received,
+                              'seconds': seconds}
+
+    def snapshot(self):
+        with self.lock:
+            return dict((method, dict(entry)) for method, entry in self.methods.items())
+
+
+def meter_transport(service_instance, stats):
+    """
+    Meters bytes on the wire per call into stats. Compression and persistent connections are pyVmomi defaults
+    (Accept-Encoding: gzip, deflate and a pool of HTTP/1.1 connections per stub); compression is left switched on.
+    Connections pooled before the call (e.g. by the login) are dropped so every later call goes through the meter.
+    """
+    stub = service_instance._stub
+    stub._acceptCompressedResponses = True
+    scheme = stub.scheme
+
+    def factory(host, **kwargs):
+        return _MeteredHTTPConnection(stats, scheme(host, **kwargs))
+    stub.scheme = factory
+    stub.DropConnections()
+
+
+class _MeteredHTTPConnection(object):
+
+    def __init__(self, stats, connection):
+        self.stats = stats
+        self.connection = connection
+        self.call = None
+
+    def request(self, method, url, body=None, headers={}):
+        match = SOAP_METHOD.search(body or '')
+        self.call = {'method': match.group(1) if match else 'unknown',
+                     'bytes_sent': len(body or ''),
+                     'started': time.time()}
+        self.connection.request(method, url, body, headers)
+
+    def getresponse(self):
+        return _MeteredHTTPResponse(self.stats, self.call, self.connection.getresponse())
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class _MeteredHTTPResponse(object):
+    """
+    Counts raw (still compressed) body bytes and reports the call once the body has been read to the end
+    """
+
+    def __init__(self, stats, call, response):
+        self.stats = stats
+        self.call = call
+        self.response = response
+        self.bytes_received = 0
+        self.reported = False
+
+    def read(self, amt=None):
+        data = self.response.read() if amt is None else self.response.read(amt)
+        self.bytes_received += len(data)
+        if not self.reported and (amt is None or not data):
+            self.reported = True
+            self.stats.add(self.call['method'],
+                           self.call['bytes_sent'],
+                           self.bytes_received,
+                           time.time() - self.call['started'])
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
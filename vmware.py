@@ -3,15 +3,66 @@ import atexit
 import paramiko
 import time
 import re
+import io
+import threading
+import contextlib
+
+import sessionpool
+import transport
+import topology
+import limiter
 
 from pyVim import connect
 from pyVmomi import vim
 from pyVmomi import vmodl
+from pyVmomi import SoapAdapter
 from requests.auth import HTTPBasicAuth
 
 
+# SSH failures that count as congestion for a host's limiter; a command's own errors come back on stderr
+SSH_ERRORS = limiter.TRANSPORT_ERRORS + (paramiko.SSHException,)
+
+
 
-class VMWare:
+class _PooledSSHClient(object):
+    """
+    Thin wrapper around a paramiko client handed out by VMWare._get_ssh_connection.
+    close() returns the client to the owning pool instead of tearing down the session.
+    """
+
+    def __init__(self, pool_owner, host_name, client, host_limiter=None):
+        self.pool_owner = pool_owner
+        self.host_name = host_name
+        self.client = client
+        self.host_limiter = host_limiter
+
+    def exec_command(self, command, **kwargs):
+        # output is read here so a failure surfaces in this call, and the slot is freed whatever the caller does next
+        try:
+            if self.host_limiter:
+                with self.host_limiter.slot(congestion=SSH_ERRORS):
+                    stdin, stdout_data, stderr_data = self._run(command, **kwargs)
+            else:
+                stdin, stdout_data, stderr_data = self._run(command, **kwargs)
+        except Exception:
+            # a session that failed mid-command is not reused; dropping it also frees its place under the host's cap
+            self.pool_owner._discard_ssh_connection(self.host_name, self.client)
+            self.client = None
+            raise
+        return stdin, io.BytesIO(stdout_data), io.BytesIO(stderr_data)
+
+    def _run(self, command, **kwargs):
+        stdin, stdout, stderr = self.client.exec_command(command, **kwargs)
+        return stdin, stdout.read(), stderr.read()
+
+    def close(self):
+        if self.client is not None:
+            self.pool_owner._release_ssh_connection(self.host_name, self.client)
+            self.client = None
+
+
+
+class VMWare(object):
     """Connects to VMware Virtual Center to provide a number of queries and methods to administor Virtual Center programtically
     This Class leverages the pyvmomi library pretty extensivly: https://github.com/vmware/pyvmomi
     Args:
@@ -20,6 +71,10 @@ class VMWare:
         vc_fqdn:    ='myVsphereFQDN'
         esxi_user:  ='myEsxiAdminId'
         esxi_password: ='myEsxiAdminpass'
+        cassette:   = cassette.Cassette('/tmp/audit.cassette', mode='record')  optional, records or replays all vCenter and ESXi traffic
+        session_pool_size: = 4  optional, number of extra vCenter sessions pooled for concurrent callers, see session()
+        meter_transport: = True  optional, meters bytes on the wire per SOAP method, see get_transport_stats()
+        adaptive_concurrency: = True  optional, AIMD limits on concurrent SOAP calls, tasks and SSH sessions per host, see get_concurrency_metrics()
 
     Example:
         As Script:
@@ -44,42 +99,133 @@ class VMWare:
                 nsx_gateway_ip = y.get_nsx_gateway_esxi_host(esxihost, 'tunneling')
                     returns active gateway 
                 switches = y.get_vswitches(host_network_system)
+                topo = y.get_topology()
+                    returns the datacenter/cluster/host/network model for in-memory queries, e.g. topo.clusters_with_network('v001_10-10-10-1_ShrdNet1')
+                configs = y.get_hosts_network_config([esxihost])
+                    returns vswitches, port groups, vnics and pnics per host, fetched in one call for any number of hosts
     Methods:
         create_bond_esxi_host(esxihost,bond_name,uplinks): create NSX bond.
         set_interface_uplink_esxi_host(esxihost, bond_name, vmk_ip, vmk_subnet): configues NSX.
         connect_uplink_esxi_host(esxihost, bond_name)
         destroy_bond_esxi_host(esxihost,bond_name): destroy NSX bond
         test_nsx_gateway_esxi_host(esxihost, 'vmk1', '10.10.10.1'): pings NSX gateay from host
+        close_ssh_connections(): closes the pooled SSH sessions to the ESXi hosts
+        close(): logs out of vCenter and closes every session this instance opened
+        get_network_snapshot(host_network_system) / restore_network_snapshot(host_network_system, snapshot): capture and roll back vswitches and port groups
     """
 
-    def __init__(self, vc_userid, vc_passwd, vc_fqdn, esxi_user, esxi_password):
+    def __init__(self, vc_userid, vc_passwd, vc_fqdn, esxi_user, esxi_password, cassette=None, session_pool_size=0,
+                 meter_transport=False, adaptive_concurrency=False):
 
         self.vc_userid = vc_userid
         self.vc_passwd = vc_passwd
-        self.vc_fqdn = vc_connection
-        self.vc_connection = self._get_vcenter_connection()
+        self.vc_fqdn = vc_fqdn
+        self.cassette = cassette
+        self.meter_transport = meter_transport
+        self.transport_stats = transport.TransportStats()
+        self.adaptive_concurrency = adaptive_concurrency
+        self.soap_limiter = None
+        self.task_limiter = None
+        self.ssh_limiters = {}
+        if adaptive_concurrency:
+            self.soap_limiter = limiter.AdaptiveLimiter('soap', initial=4, maximum=32, latency_threshold=2.0)
+            self.task_limiter = limiter.AdaptiveLimiter('task', initial=2, maximum=16, latency_threshold=5.0)
+        self.default_connection = None
+        self.session_local = threading.local()
+        self.session_pool = None
         self.vm_names = {}
         self.virtual_machines = []
         self.esxi_credentials = {"user": esxi_user,
                                 "passwd": esxi_password}
         self.esxi_hosts = []
         self.ha_clusters = [] 
+        self.topology = None
+        self.ssh_pool = {}
+        self.ssh_sessions = {}
+        self.ssh_pool_lock = threading.Condition()
+        self.closed = False
+        # the one exit handler for every session this instance opens: logins (including pool re-logins) register
+        # none of their own, and an explicit close() earlier in the process is not repeated at exit
+        atexit.register(self.close)
+        self.default_connection = self._get_vcenter_connection()
+        if session_pool_size:
+            self.session_pool = sessionpool.VCenterSessionPool(self._get_vcenter_connection, session_pool_size)
         self._init_esxi_hosts()
 
 
     def _get_vcenter_connection(self):
         service_instance = None
+        if self.cassette and self.cassette.mode == 'replay':
+            print "INFO: Replaying vCenter {} from cassette {}".format(self.vc_fqdn, self.cassette.path)
+            return self.cassette.get_service_instance(self.vc_fqdn)
         print "INFO: Connecting to vCenter {} as {}".format(self.vc_fqdn, self.vc_userid)
         try:
             service_instance = connect.SmartConnect(host=self.vc_fqdn,
                                                     user=self.vc_userid,
                                                     pwd=self.vc_passwd)
-            atexit.register(connect.Disconnect, service_instance)
         except IOError as ex:
             raise Exception("Unable to connect to the vCenter with with supplied credentials. {}".format(ex))
+        if self.cassette:
+            self.cassette.attach(service_instance)
+        if self.meter_transport:
+            transport.meter_transport(service_instance, self.transport_stats)
+        if self.soap_limiter:
+            # pyVmomi keeps poolSize (5) idle connections per stub and closes the rest as calls return; keep one for
+            # every call the limiter may let through at once so concurrent calls do not reconnect
+            service_instance._stub.poolSize = max(service_instance._stub.poolSize, self.soap_limiter.maximum)
+            limiter.limit_stub(service_instance._stub, self.soap_limiter)
         print "INFO: vCenter connection successful"
         return service_instance
 
+    @property
+    def vc_connection(self):
+        """
+        The session checked out by the calling thread through session(), otherwise the default session
+        """
+        return getattr(self.session_local, 'service_instance', None) or self.default_connection
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Checks a pooled vCenter session out for the calling thread; every method called inside the block uses it.
+        Managed objects fetched inside the block stay bound to that session, so finish with them before leaving it.
+        Without a pool (session_pool_size=0) this yields the default session.
+
+        Example:
+            with y.session():
+                host = y.get_host_by_name('myesxhost.fqdn.domain.com')
+                switches = y.get_vswitches(host.configManager.networkSystem)
+        """
+        current = getattr(self.session_local, 'service_instance', None)
+        if current or not self.session_pool:
+            yield self.vc_connection
+            return
+        service_instance = self.session_pool.checkout()
+        self.session_local.service_instance = service_instance
+        try:
+            yield service_instance
+        finally:
+            self.session_local.service_instance = None
+            self.session_pool.checkin(service_instance)
+
+    def get_concurrency_metrics(self):
+        """
+        Returns the current limits, in-flight counts and smoothed latencies of the adaptive limiters
+        """
+        if not self.adaptive_concurrency:
+            return {}
+        with self.ssh_pool_lock:
+            ssh_limiters = dict(self.ssh_limiters)
+        return {'soap': self.soap_limiter.metrics(),
+                'task': self.task_limiter.metrics(),
+                'ssh': dict((host_name, ssh_limiters[host_name].metrics()) for host_name in ssh_limiters)}
+
+    def get_transport_stats(self):
+        """
+        Returns bytes sent/received, call count and time per SOAP method, when meter_transport is enabled
+        """
+        return self.transport_stats.snapshot()
+
     def _get_container_view(self, view_type):
         content = self.vc_connection.RetrieveContent()
         container = content.rootFolder
@@ -120,13 +266,131 @@ class VMWare:
         ssh.connect(host, username=user, password=passwd)
         return ssh
 
+    def _get_ssh_limiter(self, host_name):
+        with self.ssh_pool_lock:
+            if host_name not in self.ssh_limiters:
+                self.ssh_limiters[host_name] = limiter.AdaptiveLimiter('ssh:{}'.format(host_name), initial=2, maximum=8,
+                                                                       latency_threshold=10.0)
+            return self.ssh_limiters[host_name]
+
+    def _get_ssh_connection(self, esx_host):
+        """
+        Checks out an SSH session to the ESXi host, reusing an idle one from the pool when it is still alive.
+        With adaptive_concurrency, the sessions open to a host are capped at its current limit (callers wait for
+        one to be checked in), and opening a session and each command wait for a slot under that limit.
+        """
+        host_limiter = None
+        if self.adaptive_concurrency:
+            host_limiter = self._get_ssh_limiter(esx_host.name)
+        return _PooledSSHClient(self, esx_host.name, self._checkout_ssh_client(esx_host, host_limiter), host_limiter)
+
+    def _checkout_ssh_client(self, esx_host, host_limiter=None):
+        host_name = esx_host.name
+        with self.ssh_pool_lock:
+            idle_clients = self.ssh_pool.setdefault(host_name, [])
+            client = None
+            while client is None:
+                if idle_clients:
+                    candidate = idle_clients.pop()
+                    transport = candidate.get_transport()
+                    if transport and transport.is_active():
+                        client = candidate
+                    else:
+                        candidate.close()
+                        self.ssh_sessions[host_name] -= 1
+                elif host_limiter is None or self.ssh_sessions.get(host_name, 0) < host_limiter.current_limit():
+                    # reserve the new session's place under the cap before opening it outside the lock
+                    self.ssh_sessions[host_name] = self.ssh_sessions.get(host_name, 0) + 1
+                    break
+                else:
+                    self.ssh_pool_lock.wait()
+        if client is None:
+            try:
+                if host_limiter:
+                    with host_limiter.slot(congestion=SSH_ERRORS):
+                        client = self._open_ssh_client(host_name)
+                else:
+                    client = self._open_ssh_client(host_name)
+            except Exception:
+                with self.ssh_pool_lock:
+                    self.ssh_sessions[host_name] -= 1
+                    self.ssh_pool_lock.notify_all()
+                raise
+        return client
+
+    def _open_ssh_client(self, host_name):
+        if self.cassette and self.cassette.mode == 'replay':
+            return self.cassette.wrap_ssh_client(host_name, None)
+        client = utils.get_ssh_connection(host_name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        if self.cassette:
+            client = self.cassette.wrap_ssh_client(host_name, client)
+        return client
+
+    def _release_ssh_connection(self, host_name, client):
+        with self.ssh_pool_lock:
+            self.ssh_pool.setdefault(host_name, []).append(client)
+            self.ssh_pool_lock.notify_all()
+
+    def _discard_ssh_connection(self, host_name, client):
+        try:
+            client.close()
+        except Exception:
+            pass
+        with self.ssh_pool_lock:
+            self.ssh_sessions[host_name] -= 1
+            self.ssh_pool_lock.notify_all()
+
+    def close_ssh_connections(self):
+        """
+        Closes every pooled SSH session
+        """
+        with self.ssh_pool_lock:
+            for host_name in self.ssh_pool:
+                for client in self.ssh_pool[host_name]:
+                    client.close()
+                    self.ssh_sessions[host_name] -= 1
+            self.ssh_pool = {}
+            self.ssh_pool_lock.notify_all()
+
+    def close(self):
+        """
+        Releases everything this instance opened: SSH sessions, pooled and default vCenter sessions, the topology
+        filter, and saves a recording cassette. Registered with atexit; call it directly in processes that exit
+        without running atexit handlers. Only the first call does anything.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.close_ssh_connections()
+        if self.topology is not None:
+            try:
+                self.topology.close()
+            except Exception as ex:
+                # the session may already be gone; the rest still has to be released
+                print "ERROR: unable to destroy the topology filter: {}".format(ex)
+            self.topology = None
+        if self.session_pool is not None:
+            self.session_pool.close()
+        if self.cassette:
+            self.cassette.save()
+        if self.default_connection is not None:
+            connect.Disconnect(self.default_connection)
+
+    def get_topology(self, refresh=True):
+        """
+        Returns the in-memory datacenter/cluster/host/network/datastore model, building it on first use.
+        Later calls apply only the inventory changes since the previous one unless refresh is False.
+        """
+        if self.topology is None:
+            print "INFO: Building vCenter topology"
+            self.topology = topology.Topology(self.default_connection)
+        elif refresh:
+            self.topology.refresh()
+        self.ha_clusters = self.topology.cluster_objects()
+        return self.topology
+
     def get_hosts_on_ha_cluster(self, ha_cluster_name):
-        ha_hosts = []
-        for cluster in self.ha_clusters:
-            if cluster.name == ha_cluster_name:
-                ha_hosts = cluster.host
-                host_names = [host.name for host in ha_hosts]
-        return ha_hosts
+        return self.get_topology().hosts_in_cluster(ha_cluster_name)
 
     def get_hosts(self):
         """
@@ -170,8 +434,115 @@ class VMWare:
         esxi_host = content.searchIndex.FindByDnsName(None, esx_hostname, vmSearch=False)
         return esxi_host
 
+    def find_esxi_host(self, host_name):
+        """
+        Returns the HostSystem whose DNS name or inventory name is host_name, or None.
+        Tries SearchIndex.FindByDnsName first, then matches inventory names fetched in one property collector call.
+        """
+        esxi_host = self.get_esxi_host(host_name)
+        if esxi_host is not None:
+            return esxi_host
+        view = self._get_container_view([vim.HostSystem])
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem, pathSet=['name'], all=False)
+        try:
+            objects = self._retrieve_properties([self._view_object_spec(view)], [property_spec])
+        finally:
+            view.Destroy()
+        for obj in objects:
+            if any(prop.name == 'name' and prop.val == host_name for prop in obj.propSet):
+                return obj.obj
+        return None
+
+
+
+
+    def _view_object_spec(self, view):
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView',
+                                                                     path='view',
+                                                                     skip=False,
+                                                                     type=vim.view.ContainerView)
+        return vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
 
+    def _retrieve_properties(self, obj_specs, property_specs):
+        """
+        Runs a single property collector retrieval, following continuation tokens for large result sets
+        """
+        property_collector = self.vc_connection.content.propertyCollector
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = obj_specs
+        filter_spec.propSet = property_specs
+        options = vmodl.query.PropertyCollector.RetrieveOptions()
+        objects = []
+        result = property_collector.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            objects.extend(result.objects)
+            if not result.token:
+                break
+            result = property_collector.ContinueRetrievePropertiesEx(result.token)
+        return objects
+
+    def get_hosts_network_config(self, hosts=None):
+        """
+        Fetches config.network for a set of hosts in one property collector request
+        
+        Args:
+            hosts (list): Optional list of HostSystem objects, defaults to every host in the vCenter
+        
+        Returns:
+            dict: keyed by host name, each entry holding the 'host' object and 'vswitches', 'portgroups',
+                  'vnics' and 'pnics' dictionaries keyed by vswitch name, port group name and device
+        Example: 
+            configs = y.get_hosts_network_config()
+            hosts_missing_switch = [name for name in configs if 'vswith_prod' not in configs[name]['vswitches']]
+        """
+        view = None
+        if hosts is None:
+            view = self._get_container_view([vim.HostSystem])
+            obj_specs = [self._view_object_spec(view)]
+        else:
+            obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=host) for host in hosts]
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.HostSystem,
+                                                                   pathSet=['name', 'config.network'],
+                                                                   all=False)
+        try:
+            objects = self._retrieve_properties(obj_specs, [property_spec])
+        finally:
+            if view:
+                view.Destroy()
+
+        configs = {}
+        for obj in objects:
+            props = dict((prop.name, prop.val) for prop in obj.propSet)
+            config = {'host': obj.obj,
+                      'vswitches': {},
+                      'portgroups': {},
+                      'vnics': {},
+                      'pnics': {}}
+            network_info = props.get('config.network')
+            if network_info:
+                for vswitch in network_info.vswitch or []:
+                    config['vswitches'][vswitch.name] = vswitch
+                for portgroup in network_info.portgroup or []:
+                    config['portgroups'][portgroup.spec.name] = portgroup
+                for vnic in network_info.vnic or []:
+                    config['vnics'][vnic.device] = vnic
+                for pnic in network_info.pnic or []:
+                    config['pnics'][pnic.device] = pnic
+            configs[props['name']] = config
+        return configs
+
+    def get_host_network_config(self, host):
+        """
+        Returns the get_hosts_network_config entry of a single HostSystem, or None, without reading host.name
+        """
+        return next(iter(self.get_hosts_network_config([host]).values()), None)
 
+    def get_hosts_with_vswitch(self, vswitch_name, hosts=None):
+        """
+        Returns a dictionary of host name to whether the vswitch exists on it, from a single bulk fetch
+        """
+        configs = self.get_hosts_network_config(hosts)
+        return dict((host_name, vswitch_name in configs[host_name]['vswitches']) for host_name in configs)
 
     def get_vswitches(self, host_network_system):
         vswitches = host_network_system.networkConfig.vswitch
@@ -201,6 +572,68 @@ class VMWare:
         print "Successfully created vSwitch ",  vss_name
 
 
+    def get_network_snapshot(self, host_network_system):
+        """
+        Returns the host's current network configuration (vim.host.NetworkConfig) for restore_network_snapshot
+        """
+        snapshot = host_network_system.networkConfig
+        print "Took network snapshot: {} vswitches, {} port groups".format(len(snapshot.vswitch or []), len(snapshot.portgroup or []))
+        return snapshot
+
+    def restore_network_snapshot(self, host_network_system, snapshot, changed_vswitches=()):
+        """
+        Puts vswitches and port groups back the way they were in snapshot with a single UpdateNetworkConfig call:
+        missing ones are added, ones created since removed, and existing ones edited back to their snapshot spec only
+        where it differs, so untouched networking such as vSwitch0 and the Management Network is not re-applied.
+        Vswitches named in changed_vswitches, and their port groups, are always edited back.
+        """
+        current = host_network_system.networkConfig
+        version = host_network_system._stub.version
+        snapshot_vswitches = dict((vswitch.name, vswitch) for vswitch in snapshot.vswitch or [])
+        current_vswitches = dict((vswitch.name, vswitch) for vswitch in current.vswitch or [])
+        snapshot_portgroups = dict((portgroup.spec.name, portgroup) for portgroup in snapshot.portgroup or [])
+        current_portgroups = dict((portgroup.spec.name, portgroup) for portgroup in current.portgroup or [])
+
+        vswitch_changes = []
+        for name in snapshot_vswitches:
+            if name not in current_vswitches:
+                operation = 'add'
+            elif name in changed_vswitches or not self._same_spec(snapshot_vswitches[name].spec, current_vswitches[name].spec, version):
+                operation = 'edit'
+            else:
+                continue
+            vswitch_changes.append(vim.host.VirtualSwitch.Config(changeOperation=operation,
+                                                                 name=name,
+                                                                 spec=snapshot_vswitches[name].spec))
+        removed_vswitches = [name for name in current_vswitches if name not in snapshot_vswitches]
+        for name in removed_vswitches:
+            vswitch_changes.append(vim.host.VirtualSwitch.Config(changeOperation='remove', name=name))
+
+        portgroup_changes = []
+        for name in snapshot_portgroups:
+            spec = snapshot_portgroups[name].spec
+            if name not in current_portgroups:
+                operation = 'add'
+            elif spec.vswitchName in changed_vswitches or not self._same_spec(spec, current_portgroups[name].spec, version):
+                operation = 'edit'
+            else:
+                continue
+            portgroup_changes.append(vim.host.PortGroup.Config(changeOperation=operation, spec=spec))
+        for name in current_portgroups:
+            # port groups on a removed vswitch go away with it
+            if name not in snapshot_portgroups and current_portgroups[name].spec.vswitchName not in removed_vswitches:
+                portgroup_changes.append(vim.host.PortGroup.Config(changeOperation='remove',
+                                                                   spec=current_portgroups[name].spec))
+
+        if vswitch_changes or portgroup_changes:
+            config = vim.host.NetworkConfig(vswitch=vswitch_changes, portgroup=portgroup_changes)
+            host_network_system.UpdateNetworkConfig(config=config, changeMode='modify')
+        print "Restored network snapshot: {} vswitch changes, {} port group changes".format(len(vswitch_changes), len(portgroup_changes))
+
+    def _same_spec(self, spec, other, version):
+        # pyVmomi data objects have no value equality; compare what would be sent on the wire
+        return SoapAdapter.Serialize(spec, version=version) == SoapAdapter.Serialize(other, version=version)
+
     def create_port_group(self, host_network_system, pg_name, vlanId, vswitchName):
         port_group_spec = vim.host.PortGroup.Specification()
         port_group_spec.name = pg_name
@@ -230,7 +663,7 @@ class VMWare:
 
 
     def get_vmnic_esxi_host(self, esx_host, mac_address):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "esxcli network nic list | grep {} | head -c6".format(mac_address)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -247,7 +680,7 @@ class VMWare:
         return vmnic
 
     def get_bridge_esxi_host(self, esx_host, vmnic):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsx-dbctl show | grep -i \'interface \"{}\"\' -B 2 | grep -i port | sed -e \'s/Port \"\\(.*\\)\"/\\1/\'".format(vmnic)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -264,7 +697,7 @@ class VMWare:
         return bridge
 
     def get_production_vmk_interface_esxi_host(self, esx_host, vmnic):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsx-dbctl show | grep -i \'interface \"{}\"\' -A 4 -B 4 | grep -i vmk | grep -i port | sed -e \'s/Port \"\\(.*\\)\"/\\1/\'".format(vmnic)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -282,7 +715,7 @@ class VMWare:
 
     def get_vmk_interface_ip_esxi_host(self, esx_host, vmk_interface):
     	if vmk_interface:
-	        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+	        ssh = self._get_ssh_connection(esx_host)
 	        command = "nsxcli uplink/show | grep -A 5 {}  | grep IP | sed -e \'s/IP        : \\([0-9]\\{{1,3\\}}\\.[0-9]\\{{1,3\}}\\.[0-9]\\{{1,3\\}}\.[0-9]\\{{1,3\\}}\\).*/\\1/\'".format(vmk_interface)
 	        stdin, stdout, stderr = ssh.exec_command(command)
 	        stderr_data = stderr.read()
@@ -303,7 +736,7 @@ class VMWare:
 
     def get_vmk_interface_subnet_esxi_host(self, esx_host, vmk_interface):
     	if vmk_interface:
-	        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+	        ssh = self._get_ssh_connection(esx_host)
 	        command = "nsxcli uplink/show | grep -A 5 {}  | grep Mask | sed 's/Mask      : \\([0-9]\\{{1,3\\}}\\.[0-9]\\{{1,3\}}\\.[0-9]\\{{1,3\\}}\.[0-9]\\{{1,3\\}}\\).*/\\1/\'".format(vmk_interface)
 	        stdin, stdout, stderr = ssh.exec_command(command)
 	        stderr_data = stderr.read()
@@ -323,7 +756,7 @@ class VMWare:
 	    	return None
 
     def get_nsx_gateway_esxi_host(self, esx_host, gateway_type):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsxcli gw/show | grep -i {} -A 2  | grep -i \'currently active default gateway\' | sed 's/Currently active default gateway : \\([0-9]\\{{1,3\\}}\\.[0-9]\\{{1,3\}}\\.[0-9]\\{{1,3\\}}\.[0-9]\\{{1,3\\}}\\).*/\\1/\'".format(gateway_type)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -340,7 +773,7 @@ class VMWare:
         return nsxgateway
 
     def test_nsx_gateway_esxi_host(self, esx_host, interface, gateway_ip):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "vmkping ++netstack=nsxTcpipStack -I {} {}".format(interface, gateway_ip)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -360,7 +793,7 @@ class VMWare:
 
 
     def destroy_bond_esxi_host(self, esx_host, bond):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsxcli bond/destroy {}".format(bond)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -374,7 +807,7 @@ class VMWare:
 
 
     def create_bond_esxi_host(self, esx_host, bond, uplinks):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsxcli bond/create {}  uplink={}".format(bond, uplinks)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -388,7 +821,7 @@ class VMWare:
 
 
     def set_interface_uplink_esxi_host(self, esx_host, interface, vmht_ip, vmht_subnet):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsxcli uplink/set-ip {} {} {}".format(interface, vmht_ip, vmht_subnet)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -401,7 +834,7 @@ class VMWare:
         return True
 
     def connect_uplink_esxi_host(self, esx_host, interface):
-        ssh = utils.get_ssh_connection(esx_host.name, self.esxi_credentials['user'],self.esxi_credentials['passwd'], self)
+        ssh = self._get_ssh_connection(esx_host)
         command = "nsxcli uplink/connect {}".format(interface)
         stdin, stdout, stderr = ssh.exec_command(command)
         stderr_data = stderr.read()
@@ -451,6 +884,12 @@ class VMWare:
 
                             if state == vim.TaskInfo.State.success:
                                 task_state = True
+                                if self.task_limiter:
+                                    # time spent queued in vCenter is the task path's congestion signal; read from
+                                    # task.info as partial updates usually only carry info.state
+                                    info = task.info
+                                    if info.queueTime and info.startTime:
+                                        self.task_limiter.observe(self._seconds_between(info.queueTime, info.startTime))
                                 task_list.remove(str(task))
                             elif state == vim.TaskInfo.State.error:
                                 raise task.info.error
@@ -464,6 +903,10 @@ class VMWare:
 
 
 
+    def _seconds_between(self, earlier, later):
+        delta = later - earlier
+        return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
     def _get_all_objs(content, vimtype):
         """
         Get all the vsphere objects associated with a given type, sometimes this takes a long time.
@@ -607,6 +1050,11 @@ class VMWare:
         dev_changes.append(virtual_nic_spec)
         spec = vim.vm.ConfigSpec()
         spec.deviceChange = dev_changes
-        task = vm_obj.ReconfigVM_Task(spec=spec)
-        self.wait_for_tasks([task])
+        if self.task_limiter:
+            with self.task_limiter.slot(measure=False):
+                task = vm_obj.ReconfigVM_Task(spec=spec)
+                self.wait_for_tasks([task])
+        else:
+            task = vm_obj.ReconfigVM_Task(spec=spec)
+            self.wait_for_tasks([task])
         return True 
\ No newline at end of file